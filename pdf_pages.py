@@ -0,0 +1,38 @@
+"""PDF text extraction, spread over worker processes for long documents.
+
+Kept out of plagiarism_checker_web.py so worker processes can import the
+extraction function without re-running the Streamlit script.
+"""
+import os
+import multiprocessing
+
+import pymupdf
+
+MAX_WORKERS = 4
+# PyMuPDF extracts a dense page in about a millisecond, while a spawned worker takes most of a second to
+# start and import it. Below a thousand pages per worker, extracting in-process is faster.
+MIN_PAGES_PER_WORKER = 1000
+
+def _extract_pages(doc, start, stop):
+    return "".join(doc[i].get_text() for i in range(start, stop))
+
+def extract_page_range(args):
+    """Extracts pages [start, stop) from the PDF bytes with a document handle of its own."""
+    pdf_bytes, start, stop = args
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return _extract_pages(doc, start, stop)
+
+def extract_text(pdf_bytes):
+    """Returns the text of every page, one contiguous page range per worker process."""
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+        workers = min(os.cpu_count() or 1, MAX_WORKERS, page_count // MIN_PAGES_PER_WORKER)
+        if workers <= 1:
+            return _extract_pages(doc, 0, page_count)
+
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    # Spawn rather than fork: forking the multi-threaded Streamlit server can deadlock the child on
+    # locks held by other threads.
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        parts = pool.map(extract_page_range, [(pdf_bytes, bounds[i], bounds[i + 1]) for i in range(workers)])
+    return "".join(parts)
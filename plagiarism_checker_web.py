@@ -1,103 +1,542 @@
 import streamlit as st
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 import os
-import requests
+import re
+import html
+import io
+import string
+import json
+import hashlib
+import sqlite3
+import functools
+import threading
+import random
+from contextlib import closing
+from typing import NamedTuple
+import httpx
 import time
-from collections import defaultdict
-from nltk.tokenize import sent_tokenize, word_tokenize
-import PyPDF2
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from nltk.tokenize import PunktTokenizer
+from nltk.corpus import stopwords
 import docx
+from datasketch import MinHash, MinHashLSH
+import pdf_pages
 from googlesearch import search
 import nltk
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+MAX_CONCURRENT_REQUESTS = 20
+BULK_QUERY_SIZE = 20
+MAX_BULK_QUERY_CHARS = 2000
+CACHE_PATH = os.path.join(".plagcache", "lookups.sqlite3")
+CACHE_TTL_SECONDS = 30 * 86400
+WEB_REQUESTS_PER_MINUTE = 20
+WEB_REQUEST_JITTER_SECONDS = 1.0
+MIN_QUERY_WORDS = 10
+MAX_QUERY_WORDS = 40
+MIN_ALPHA_RATIO = 0.7
+NEAR_DUPLICATE_THRESHOLD = 0.9
+NEAR_DUPLICATE_CANDIDATE_THRESHOLD = 0.7
+MINHASH_PERMUTATIONS = 128
+HTTP_MAX_RETRIES = 3
+USER_AGENT = "ProPlagiarismChecker/1.0"
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_MAX_RETRY_AFTER_SECONDS = 30
+
+@st.cache_resource(show_spinner=False)
+def get_http_client():
+    """Returns the HTTP/2 client shared by all lookups; concurrent requests to a host multiplex over one connection."""
+    return httpx.Client(http2=True, timeout=10, headers={"User-Agent": USER_AGENT}, limits=httpx.Limits(
+        max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS
+    ))
+
+def _retry_after_seconds(response):
+    """Returns how long a 429 or 503 response asks the client to wait, or 0 if it doesn't say."""
+    if response.status_code not in (429, 503): return 0.0
+    value = response.headers.get("Retry-After", "")
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 0.0
+
+def http_get(url, params, headers=None):
+    """GETs url with the shared client, retrying transient failures with exponential backoff.
+
+    A rate-limited response's Retry-After is honoured (up to HTTP_MAX_RETRY_AFTER_SECONDS) when it
+    asks for longer than the backoff, so retries don't burn out before the limit resets.
+    """
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        delay = 0.5 * 2 ** attempt
+        try:
+            response = get_http_client().get(url, params=params, headers=headers)
+        except httpx.TransportError:
+            if attempt == HTTP_MAX_RETRIES: raise
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            delay = max(delay, min(_retry_after_seconds(response), HTTP_MAX_RETRY_AFTER_SECONDS))
+        time.sleep(delay)
+
+def get_secret(name):
+    """Reads a setting from .streamlit/secrets.toml, falling back to an environment variable."""
+    if st.secrets.load_if_toml_exists() and name in st.secrets:
+        return st.secrets[name]
+    return os.environ.get(name)
+
+def semantic_scholar_headers():
+    """Authenticates Semantic Scholar requests when an API key is configured, lifting the shared anonymous rate limit."""
+    api_key = get_secret("SEMANTIC_SCHOLAR_API_KEY")
+    return {'x-api-key': api_key} if api_key else None
+
+class RateLimiter:
+    """Spaces calls at least `interval` seconds apart across all threads.
+
+    Unlike a fixed sleep, time already spent waiting on the network counts toward the interval.
+    Each slot is pushed back by up to `jitter` seconds, so queued workers don't fire in lockstep.
+    """
+    def __init__(self, interval, jitter=0.0):
+        self.interval = interval
+        self.jitter = jitter
+        self.next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            # The jitter delays the slot itself, so the next call is still spaced a full interval after it.
+            slot = max(now, self.next_allowed) + random.uniform(0, self.jitter)
+            self.next_allowed = slot + self.interval
+        time.sleep(slot - now)
+
+# Cached as a resource so the schedule survives Streamlit's script reruns.
+@st.cache_resource(show_spinner=False)
+def get_web_rate_limiter():
+    return RateLimiter(60 / WEB_REQUESTS_PER_MINUTE, jitter=WEB_REQUEST_JITTER_SECONDS)
+
+@st.cache_resource(show_spinner=False)
+def _init_cache():
+    """Creates the lookup cache once per process and drops entries that have expired since the last run."""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with closing(sqlite3.connect(CACHE_PATH)) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        conn.execute("DELETE FROM lookups WHERE expires <= ?", (time.time(),))
+    return CACHE_PATH
+
+def _cache_connect():
+    return sqlite3.connect(_init_cache(), timeout=10)
+
+def _cache_key(sentence, endpoint):
+    # Normalized, so a sentence shares its entry whether it arrives raw (bulk search) or normalized,
+    # and however a PDF wrapped its lines.
+    return hashlib.blake2b(f"{normalize_query(sentence)}|{endpoint}".encode("utf-8")).hexdigest()
+
+def cache_get(sentence, endpoint):
+    """Returns (True, result) for an unexpired cached lookup, otherwise (False, None)."""
+    with closing(_cache_connect()) as conn:
+        row = conn.execute("SELECT value FROM lookups WHERE key = ? AND expires > ?",
+                           (_cache_key(sentence, endpoint), time.time())).fetchone()
+    return (True, json.loads(row[0])) if row else (False, None)
+
+def cache_set(sentence, endpoint, result):
+    """Stores a lookup result (None included, so misses are not re-queried) until it expires."""
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)",
+                     (_cache_key(sentence, endpoint), json.dumps(result), time.time() + CACHE_TTL_SECONDS))
+
+def disk_cached(endpoint):
+    """Caches a sentence lookup on disk under endpoint. Lookups that raise are not cached."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(sentence):
+            hit, result = cache_get(sentence, endpoint)
+            if hit: return result
+            result = func(sentence)
+            cache_set(sentence, endpoint, result)
+            return result
+        return wrapper
+    return decorator
 
 @st.cache_resource
 def download_nltk_data():
     try:
-        nltk.data.find('tokenizers/punkt')
+        nltk.data.find('tokenizers/punkt_tab')
         nltk.data.find('corpora/stopwords')
     except LookupError:
-        nltk.download('punkt', quiet=True)
+        nltk.download('punkt_tab', quiet=True)
         nltk.download('stopwords', quiet=True)
 
 download_nltk_data()
 
+@st.cache_resource(show_spinner=False)
+def get_sentence_tokenizer():
+    """Loads the Punkt model once per process and reuses the instance for every document."""
+    return PunktTokenizer("english")
+
+@st.cache_data(show_spinner=False)
+def sentence_spans(document_text):
+    """Returns the (start, end) offsets of each sentence; cached on the text, so re-checking an upload skips tokenization."""
+    return list(get_sentence_tokenizer().span_tokenize(document_text))
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def count_words(document_text):
+    """Counts words with one compiled-regex pass; a full Treebank tokenization is not needed for a count."""
+    return len(WORD_PATTERN.findall(document_text))
+
+# Keyed on the file's contents, so reruns and repeated checks of the same upload skip parsing.
+@st.cache_data(show_spinner=False, hash_funcs={UploadedFile: lambda f: hashlib.blake2b(f.getvalue()).hexdigest()})
 def read_document(uploaded_file):
     """Reads text from uploaded .pdf, .docx, or .txt file."""
     text = ""
     try:
-        uploaded_file.seek(0)
-        file_name = uploaded_file.name
-        if file_name.endswith('.pdf'):
-            reader = PyPDF2.PdfReader(uploaded_file)
-            for page in reader.pages: text += (page.extract_text() or "") + "\n"
-        elif file_name.endswith('.docx'):
-            doc = docx.Document(uploaded_file)
-            for para in doc.paragraphs: text += para.text + "\n"
-        elif file_name.endswith('.txt'):
-            text = uploaded_file.getvalue().decode("utf-8")
+        # Materialize the upload once; every reader below works from the same bytes.
+        data = uploaded_file.getvalue()
+        suffix = uploaded_file.name.rsplit(".", 1)[-1].lower()
+        if suffix == "pdf":
+            text = pdf_pages.extract_text(data)
+        elif suffix == "docx":
+            doc = docx.Document(io.BytesIO(data))
+            # A blank line between paragraphs, so the highlighted view keeps them apart.
+            text = "\n\n".join(para.text for para in doc.paragraphs)
+        elif suffix == "txt":
+            text = data.decode("utf-8")
         return text
     except Exception as e:
         st.error(f"ERROR: Could not read file. Reason: {e}")
         return None
 
-def check_self_plagiarism(sentences):
-    """Checks for duplicate sentences within the same document."""
-    seen_sentences = defaultdict(list)
+class SentenceRecord(NamedTuple):
+    start: int
+    end: int
+    text: str
+    normalized: str
+    word_count: int
+
+def preprocess_sentences(document_text, spans):
+    """Normalizes every sentence once into a record shared by all analysis and rendering stages.
+
+    Records keep their offsets into the document, so rendering slices the original text
+    instead of holding further copies of every sentence.
+    """
+    records = []
+    for start, end in spans:
+        text = document_text[start:end].strip()
+        records.append(SentenceRecord(
+            start=start, end=end, text=text, normalized=normalize_query(text), word_count=len(text.split())
+        ))
+    return records
+
+def _shingles(text, size=3):
+    """Returns the set of overlapping character n-grams of text, encoded for MinHash."""
+    return {text[i:i + size].encode("utf-8") for i in range(max(1, len(text) - size + 1))}
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+def _minhashes(shingle_sets):
+    """MinHashes many shingle sets at once; datasketch hashes them against one shared permutation
+    table instead of regenerating it for every set."""
+    return MinHash.bulk([list(shingles) for shingles in shingle_sets], num_perm=MINHASH_PERMUTATIONS)
+
+def check_self_plagiarism(records):
+    """Checks for repeated or closely paraphrased sentences within the same document."""
+    # Exact repeats (ignoring punctuation, so "Foo." repeats "Foo!") are resolved with a dict lookup
+    # up front, so only the first occurrence of each text is MinHashed, all in one batch.
+    first_line_of = {}
+    exact_first = {}
+    for i, record in enumerate(records, 1):
+        if record.word_count > 8:
+            exact_first[i] = first_line_of.setdefault(_match_key(record.normalized), i)
+    shingles = {i: _shingles(records[i - 1].normalized) for i in first_line_of.values()}
+    minhashes = dict(zip(shingles, _minhashes(shingles.values())))
+
+    # The LSH index only proposes candidates, so each sentence is compared against likely duplicates
+    # in one pass. Its threshold sits below NEAR_DUPLICATE_THRESHOLD so the banding rarely misses a true
+    # near-duplicate; candidates are then confirmed on the exact Jaccard similarity of the shingle sets.
+    lsh = MinHashLSH(threshold=NEAR_DUPLICATE_CANDIDATE_THRESHOLD, num_perm=MINHASH_PERMUTATIONS)
+    group_of = {}
+    repeated = {}
+    for i, first in exact_first.items():
+        if i != first:
+            group_of[i] = group_of[first]
+        else:
+            similar = [hit for hit in lsh.query(minhashes[i])
+                       if _jaccard(shingles[i], shingles[hit]) >= NEAR_DUPLICATE_THRESHOLD]
+            # Join the earliest group this sentence resembles, or start a new one.
+            group_of[i] = min((group_of[hit] for hit in similar), default=i)
+            lsh.insert(i, minhashes[i])
+        # Most sentences are unique; a group only gets a line list once a second sentence joins it.
+        if group_of[i] != i:
+            repeated.setdefault(group_of[i], [group_of[i]]).append(i)
+
     duplicates = []
-    for i, sentence in enumerate(sentences, 1):
-        normalized_sentence = sentence.strip().lower()
-        if len(normalized_sentence.split()) > 8:
-            seen_sentences[normalized_sentence].append(i)
-    
-    for sentence_key, lines in seen_sentences.items():
-        if len(lines) > 1:
-            original_sentence = next((s for s in sentences if s.strip().lower() == sentence_key), sentence_key)
-            duplicates.append({
-                "sentence": original_sentence, "lines": lines, "type": "Self-Plagiarism",
-                "source": f"Repeated {len(lines)} times in the document."
-            })
+    for first in sorted(repeated):
+        lines = repeated[first]
+        near_duplicates = [line for line in lines if exact_first[line] != first]
+        source = f"Repeated {len(lines)} times in the document."
+        if near_duplicates:
+            source = f"Repeated {len(lines)} times in the document, {len(near_duplicates)} of them paraphrased."
+        duplicates.append({
+            "sentence": records[first - 1].text, "lines": lines, "type": "Self-Plagiarism",
+            "source": source, "near_duplicate_lines": near_duplicates
+        })
     return duplicates
 
-def check_sentence_academic(sentence):
-    """Queries Semantic Scholar API to find matches in academic papers."""
-    try:
-        query = f'"{sentence}"'
-        api_url = "https://api.semanticscholar.org/graph/v1/paper/search"
-        params = {'query': query, 'fields': 'title,authors,url', 'limit': 1}
-        response = requests.get(api_url, params=params, timeout=10)
-        response.raise_for_status()
-        results = response.json()
-        
-        if results.get('total', 0) > 0 and results.get('data'):
-            paper = results['data'][0]
-            authors = ", ".join([author['name'] for author in paper.get('authors', [])])
-            return {"title": paper['title'], "authors": authors, "url": paper['url']}
-        return None
-    except requests.RequestException:
+def _paper_details(paper):
+    """Extracts the fields shown in reports from a Semantic Scholar paper record."""
+    authors = ", ".join([author['name'] for author in paper.get('authors', [])])
+    return {"title": paper['title'], "authors": authors, "url": paper['url'], "provider": "Semantic Scholar"}
+
+def _match_key(text):
+    """Lowercases text and keeps only its words, for punctuation-insensitive comparison."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def normalize_query(sentence):
+    """Lowercases a sentence and collapses its whitespace, so equivalent queries share cache entries."""
+    return " ".join(sentence.lower().split())
+
+@functools.lru_cache(maxsize=4096)
+@disk_cached("s2")
+def _search_semantic_scholar(sentence):
+    query = f'"{sentence}"'
+    api_url = "https://api.semanticscholar.org/graph/v1/paper/search"
+    params = {'query': query, 'fields': 'title,authors,url', 'limit': 1}
+    results = http_get(api_url, params, semantic_scholar_headers()).json()
+    
+    if results.get('total', 0) > 0 and results.get('data'):
+        return _paper_details(results['data'][0])
+    return None
+
+@functools.lru_cache(maxsize=4096)
+@disk_cached("openalex")
+def _search_openalex(sentence):
+    params = {'search': f'"{sentence}"', 'per-page': 1}
+    results = http_get("https://api.openalex.org/works", params).json().get('results')
+    if not results:
         return None
+    work = results[0]
+    # OpenAlex leaves author names null for some records; list the ones it has.
+    names = ((authorship.get('author') or {}).get('display_name') for authorship in work.get('authorships') or [])
+    authors = ", ".join(name for name in names if name)
+    return {"title": work['display_name'], "authors": authors, "url": work.get('doi') or work['id'], "provider": "OpenAlex"}
+
+# Tried in order; a provider that errors out (e.g. still rate-limited after retries) hands over to the next.
+ACADEMIC_PROVIDERS = [_search_semantic_scholar, _search_openalex]
+
+def check_sentence_academic(sentence):
+    """Queries academic search APIs to find matches in academic papers, failing over between providers."""
+    query = normalize_query(sentence)
+    for search_provider in ACADEMIC_PROVIDERS:
+        try:
+            paper = search_provider(query)
+        except (httpx.HTTPError, ValueError, KeyError, TypeError):
+            # Includes malformed responses, which are just as much a reason to try the next provider.
+            continue
+        # Copy, so callers never mutate the memoized result.
+        return dict(paper) if paper else None
+    return None
+
+def _bulk_query(sentences):
+    return " | ".join('"' + sentence.replace('"', '') + '"' for sentence in sentences)
+
+def bulk_query_batches(sentences):
+    """Splits sentences into bulk-search batches of at most BULK_QUERY_SIZE sentences and
+    MAX_BULK_QUERY_CHARS query characters, so a batch of long sentences still fits in the request URL."""
+    batches = []
+    batch = []
+    for sentence in sentences:
+        if batch and (len(batch) == BULK_QUERY_SIZE or len(_bulk_query(batch + [sentence])) > MAX_BULK_QUERY_CHARS):
+            batches.append(batch)
+            batch = []
+        batch.append(sentence)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def check_sentences_academic_bulk(sentences):
+    """Searches Semantic Scholar for many sentences per request via the bulk search endpoint.
+
+    Returns a dict mapping each checked sentence to its matching paper, or None. Sentences
+    whose batch request failed are left out so the caller can look them up individually.
+    """
+    api_url = "https://api.semanticscholar.org/graph/v1/paper/search/bulk"
+    results = {}
+    uncached = []
+    for sentence in sentences:
+        hit, paper = cache_get(sentence, "s2")
+        if hit: results[sentence] = paper
+        else: uncached.append(sentence)
+
+    for batch in bulk_query_batches(uncached):
+        params = {'query': _bulk_query(batch), 'fields': 'title,authors,url,abstract'}
+        try:
+            papers = http_get(api_url, params, semantic_scholar_headers()).json().get('data') or []
+        except (httpx.HTTPError, ValueError):
+            continue
+
+        # The OR query says some sentence in the batch matched; find out which, and in which paper.
+        paper_texts = [(paper, _match_key(f"{paper.get('title') or ''} {paper.get('abstract') or ''}")) for paper in papers]
+        for sentence in batch:
+            key = _match_key(sentence)
+            paper = next((paper for paper, text in paper_texts if key in text), None)
+            results[sentence] = _paper_details(paper) if paper else None
+            cache_set(sentence, "s2", results[sentence])
+    return results
+
+@functools.lru_cache(maxsize=4096)
+@disk_cached("web")
+def _search_web(sentence):
+    query = f'"{sentence}"'
+    api_key, engine_id = get_secret("GOOGLE_CSE_KEY"), get_secret("GOOGLE_CSE_ID")
+    if api_key and engine_id:
+        params = {'key': api_key, 'cx': engine_id, 'q': query, 'num': 1}
+        items = http_get("https://www.googleapis.com/customsearch/v1", params).json().get('items')
+        return items[0]['link'] if items else None
+
+    brave_key = get_secret("BRAVE_SEARCH_API_KEY")
+    if brave_key:
+        headers = {'X-Subscription-Token': brave_key, 'Accept': 'application/json'}
+        results = http_get("https://api.search.brave.com/res/v1/web/search", {'q': query, 'count': 1}, headers).json()
+        hits = (results.get('web') or {}).get('results')
+        return hits[0]['url'] if hits else None
+
+    # Without any API credentials, scrape Google's result page instead, throttled to avoid CAPTCHAs.
+    get_web_rate_limiter().acquire()
+    search_results = list(search(query, num_results=1, lang="en"))
+    if search_results: return search_results[0]
+    return None
 
 def check_sentence_web(sentence):
-    """Performs a Google search to find web matches."""
+    """Searches the web for matches via Google Custom Search or Brave Search when configured, else Google's result page."""
     try:
-        query = f'"{sentence}"'
-        time.sleep(2)
-        search_results = list(search(query, num_results=1, lang="en"))
-        if search_results: return search_results[0]
-        return None
+        return _search_web(normalize_query(sentence))
     except Exception:
         return None
 
-def generate_highlighted_text(sentences, matches):
-    """Generates an HTML string with plagiarized sentences highlighted."""
-    plagiarized_sentences = {match['sentence'].strip() for match in matches}
+def check_sentence_external(sentence, academic_results):
+    """Checks a sentence against academic sources first, falling back to the web.
+
+    academic_results holds the bulk search outcomes; sentences missing from it are searched individually.
+    """
+    if sentence in academic_results:
+        academic_match = academic_results[sentence]
+    else:
+        academic_match = check_sentence_academic(sentence)
+    if academic_match:
+        return {"type": "Academic Match", "source_details": academic_match}
+    web_match_url = check_sentence_web(sentence)
+    if web_match_url:
+        return {"type": "Web Match", "source_details": web_match_url}
+    return None
+
+@st.cache_resource(show_spinner=False)
+def get_stopwords():
+    return frozenset(stopwords.words("english"))
+
+def is_searchable(record):
+    """Decides locally whether a sentence is worth a network lookup.
+
+    Quoted searches for tables, citations or formulas, or for very long sentences, practically
+    never match, so only prose-like sentences of a searchable length are sent out.
+    """
+    if not MIN_QUERY_WORDS <= record.word_count <= MAX_QUERY_WORDS:
+        return False
+    words = [word.strip(string.punctuation) for word in record.normalized.split()]
+    if sum(word.isalpha() for word in words) / len(words) < MIN_ALPHA_RATIO:
+        return False
+    stop = get_stopwords()
+    return sum(word in stop for word in words) >= 2
+
+def run_full_analysis(records, on_progress=None):
+    """Runs the self-plagiarism check, then the academic/web lookups concurrently."""
+    all_matches = check_self_plagiarism(records)
+    # Sentences already flagged as self-plagiarism are counted as matches; don't spend lookups on them.
+    flagged_lines = {line for match in all_matches for line in match["lines"]}
+
+    # Every repeated sentence was flagged above, so each one left appears on a single line.
+    occurrences = {}
+    for line_num, record in enumerate(records, 1):
+        if line_num not in flagged_lines and is_searchable(record):
+            occurrences[record.normalized] = (line_num, record.text)
+    unique_sentences = {text: key for key, (_, text) in occurrences.items()}
+    batches = bulk_query_batches(list(unique_sentences))
+
+    external_matches = []
+    # Not a `with` block: leaving one waits for every queued lookup. Streamlit stops or reruns the
+    # script by raising out of on_progress, and that must not sit behind minutes of throttled searches.
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+    try:
+        # Queue each batch's web fallbacks as soon as its academic search returns, so they overlap
+        # the Semantic Scholar batches still in flight instead of waiting for all of them.
+        batch_futures = {executor.submit(check_sentences_academic_bulk, batch): batch for batch in batches}
+        futures = {}
+        for batch_future in as_completed(batch_futures):
+            academic_results = batch_future.result()
+            for sentence in batch_futures[batch_future]:
+                futures[executor.submit(check_sentence_external, sentence, academic_results)] = unique_sentences[sentence]
+
+        for done, future in enumerate(as_completed(futures), 1):
+            if on_progress: on_progress(done, len(futures))
+            match = future.result()
+            if match:
+                line_num, sentence = occurrences[futures[future]]
+                external_matches.append({"sentence": sentence, "line_num": line_num, **match})
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    # Lookups finish out of order; report external matches in document order.
+    all_matches.extend(sorted(external_matches, key=lambda m: m["line_num"]))
+    return all_matches
+
+# Highlights share one CSS class, so each span carries a short class name instead of a full inline style.
+HIGHLIGHT_STYLE = "<style>.plagiarized { background-color: #ffcccb; padding: 2px 4px; border-radius: 3px; }</style>"
+HIGHLIGHT_TEMPLATE = "<span class='plagiarized'>{}</span>"
+# A blank line, including CRLF line endings and lines holding only spaces.
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def _gap_html(gap):
+    """Renders the text between two sentences: paragraph breaks survive, other whitespace becomes a space."""
+    if not gap: return ""
+    return "<br><br>" if PARAGRAPH_BREAK.search(gap) else " "
+
+def generate_highlighted_text(document_text, records, matches):
+    """Generates an HTML string of the document with plagiarized sentences highlighted."""
+    # Highlight by line, since near-duplicate findings cover sentences whose text differs.
+    plagiarized_lines = set()
+    for match in matches:
+        plagiarized_lines.update(match['lines'] if 'lines' in match else [match['line_num']])
     highlighted_parts = []
-    for sentence in sentences:
-        clean_sentence = sentence.strip()
-        if clean_sentence in plagiarized_sentences:
-            highlighted_parts.append(f"<span style='background-color: #ffcccb; padding: 2px 4px; border-radius: 3px;'>{sentence}</span>")
+    position = 0
+    for line_num, record in enumerate(records, 1):
+        highlighted_parts.append(_gap_html(document_text[position:record.start]))
+        sentence = html.escape(" ".join(document_text[record.start:record.end].split()), quote=False)
+        highlighted_parts.append(HIGHLIGHT_TEMPLATE.format(sentence) if line_num in plagiarized_lines else sentence)
+        position = record.end
+    return "".join(highlighted_parts)
+
+def findings_table(matches):
+    """Flattens the findings into table rows, so they render as one dataframe instead of a widget each."""
+    rows = []
+    for match in matches:
+        if match['type'] == "Self-Plagiarism":
+            lines, source, link = ", ".join(map(str, match['lines'])), match['source'], None
+        elif match['type'] == "Academic Match":
+            details = match['source_details']
+            source = f"{details['title']} ({details['authors']}) via {details.get('provider', 'Semantic Scholar')}"
+            lines, link = str(match['line_num']), details['url']
         else:
-            highlighted_parts.append(sentence)
-    return " ".join(highlighted_parts)
+            lines, source, link = str(match['line_num']), match['source_details'], match['source_details']
+        rows.append({"Type": match['type'], "Lines": lines, "Sentence": match['sentence'], "Source": source, "Link": link})
+    return rows
 
 def generate_report_content(matches, summary_stats):
     """Generates a downloadable text report of the findings."""
@@ -115,12 +554,15 @@ def generate_report_content(matches, summary_stats):
             report.append(f"  Type: {match['type']}")
             if match['type'] == "Self-Plagiarism":
                 report.append(f"  Found on lines: {', '.join(map(str, match['lines']))}")
+                if match.get('near_duplicate_lines'):
+                    report.append(f"  Paraphrased on lines: {', '.join(map(str, match['near_duplicate_lines']))}")
             else:
                 report.append(f"  Found on line: {match['line_num']}")
             if 'source_details' in match:
                 if match['type'] == "Academic Match":
                     report.append(f"  Source: [{match['source_details']['title']}]({match['source_details']['url']})")
                     report.append(f"  Authors: {match['source_details']['authors']}")
+                    report.append(f"  Provider: {match['source_details'].get('provider', 'Semantic Scholar')}")
                 elif match['type'] == "Web Match":
                     report.append(f"  Source: {match['source_details']}")
     return "\n".join(report)
@@ -131,8 +573,8 @@ with st.sidebar:
     st.title("About the Checker")
     st.info(
         "This tool provides a comprehensive plagiarism check by analyzing a document through three stages:\n"
-        "1.  **Self-Plagiarism**: Detects repeated sentences within the document itself.\n"
-        "2.  **Academic Search**: Queries Semantic Scholar for academic matches.\n"
+        "1.  **Self-Plagiarism**: Detects repeated or closely paraphrased sentences within the document itself.\n"
+        "2.  **Academic Search**: Queries Semantic Scholar, falling back to OpenAlex, for academic matches.\n"
         "3.  **Web Search**: Performs a Google search for matches on public websites."
     )
     st.warning("Note: This is a tool for preliminary checks. Always consult official plagiarism services for definitive reports.")
@@ -160,89 +602,65 @@ if start_button and uploaded_file:
     with st.spinner("Reading and analyzing document... This may take a few moments."):
         document_text = read_document(uploaded_file)
         if document_text:
-            sentences = sent_tokenize(document_text)
-            words = word_tokenize(document_text)
-            total_sentences = len(sentences)
-            total_words = len(words)
-            all_matches = []
-            all_matches.extend(check_self_plagiarism(sentences))
-            
+            sentences = preprocess_sentences(document_text, sentence_spans(document_text))
             progress_bar = st.progress(0, text="Initializing check...")
-            matched_sentences_for_external_check = set()
-            
-            for line_num, sentence in enumerate(sentences, 1):
-                clean_sentence = sentence.strip()
-                if len(clean_sentence.split()) < 10 or clean_sentence in matched_sentences_for_external_check:
-                    continue
-                
-                progress_bar.progress(line_num / total_sentences, text=f"Analyzing sentence {line_num}/{total_sentences}")
-                
-                academic_match = check_sentence_academic(clean_sentence)
-                if academic_match:
-                    all_matches.append({
-                        "sentence": clean_sentence, "line_num": line_num, "type": "Academic Match",
-                        "source_details": academic_match
-                    })
-                    matched_sentences_for_external_check.add(clean_sentence)
-                    continue
-
-                web_match_url = check_sentence_web(clean_sentence)
-                if web_match_url:
-                    all_matches.append({
-                        "sentence": clean_sentence, "line_num": line_num, "type": "Web Match",
-                        "source_details": web_match_url
-                    })
-                    matched_sentences_for_external_check.add(clean_sentence)
-
+            all_matches = run_full_analysis(
+                sentences,
+                on_progress=lambda done, total: progress_bar.progress(done / total, text=f"Checked sentence {done}/{total}")
+            )
             progress_bar.empty()
-
-            matches_count = len(all_matches)
-            similarity_percentage = (matches_count / total_sentences * 100) if total_sentences > 0 else 0
-            originality_percentage = 100 - similarity_percentage
-            
-            total_sentences_ph.metric("Total Sentences", f"{total_sentences}")
-            total_words_ph.metric("Total Words", f"{total_words}")
-            matches_found_ph.metric("Matches Found", f"{matches_count}")
-            similarity_ph.metric("Similarity", f"{similarity_percentage:.2f}%")
-            originality_ph.metric("Originality", f"{originality_percentage:.2f}%")
-            
-            st.subheader("Results")
-            
-            if matches_count == 0:
+            # Streamlit reruns the whole script on every interaction (tabs, downloads), so keep the
+            # tokenized document and findings around instead of losing or recomputing them.
+            st.session_state.analysis = {
+                "file_id": uploaded_file.file_id, "document_text": document_text, "sentences": sentences,
+                "total_words": count_words(document_text), "matches": all_matches
+            }
+            if not all_matches:
                 st.balloons()
-                st.success("### 🎉 Excellent! No potential plagiarism matches were found.")
-            else:
-                tab1, tab2, tab3 = st.tabs(["📊 Highlights", "🔍 Detailed Findings", "📥 Download Report"])
-
-                with tab1:
-                    st.info("Sentences flagged for potential plagiarism are highlighted below.")
-                    highlighted_doc = generate_highlighted_text(sentences, all_matches)
-                    st.markdown(f"<div style='border: 1px solid #ddd; padding: 15px; border-radius: 5px; background-color: #f9f9f9; max-height: 400px; overflow-y: auto;'>{highlighted_doc}</div>", unsafe_allow_html=True)
-
-                with tab2:
-                    st.info("Click on each finding to expand and see more details.")
-                    for match in all_matches:
-                        if match['type'] == "Self-Plagiarism":
-                            with st.expander(f"🚨 **Self-Plagiarism**: Sentence repeated {len(match['lines'])} times"):
-                                st.markdown(f"**Sentence:** \"_{match['sentence']}_\"")
-                                st.markdown(f"**Found on lines:** {', '.join(map(str, match['lines']))}")
-                        else:
-                            with st.expander(f"🚨 **{match['type']}**: Match on line {match['line_num']}"):
-                                st.markdown(f"**Original Sentence:** \"_{match['sentence']}_\"")
-                                if match['type'] == 'Academic Match':
-                                    st.markdown(f"**Source:** [{match['source_details']['title']}]({match['source_details']['url']})")
-                                    st.markdown(f"**Authors:** {match['source_details']['authors']}")
-                                elif match['type'] == 'Web Match':
-                                    st.markdown(f"**Source:** [{match['source_details']}]({match['source_details']})")
-                
-                with tab3:
-                    st.info("Download a full text report of all findings for your records.")
-                    summary_stats = {
-                        "Total Sentences": total_sentences, "Total Words": total_words, "Matches Found": matches_count,
-                        "Similarity": f"{similarity_percentage:.2f}%", "Originality": f"{originality_percentage:.2f}%"
-                    }
-                    report_data = generate_report_content(all_matches, summary_stats)
-                    st.download_button(
-                        label="📥 Download Full Report (.txt)", data=report_data, file_name="plagiarism_report.txt",
-                        mime="text/plain", use_container_width=True
-                    )
\ No newline at end of file
+
+analysis = st.session_state.get("analysis")
+if analysis and uploaded_file and analysis["file_id"] == uploaded_file.file_id:
+    sentences = analysis["sentences"]
+    all_matches = analysis["matches"]
+    total_sentences = len(sentences)
+    total_words = analysis["total_words"]
+    matches_count = len(all_matches)
+    similarity_percentage = (matches_count / total_sentences * 100) if total_sentences > 0 else 0
+    originality_percentage = 100 - similarity_percentage
+
+    total_sentences_ph.metric("Total Sentences", f"{total_sentences}")
+    total_words_ph.metric("Total Words", f"{total_words}")
+    matches_found_ph.metric("Matches Found", f"{matches_count}")
+    similarity_ph.metric("Similarity", f"{similarity_percentage:.2f}%")
+    originality_ph.metric("Originality", f"{originality_percentage:.2f}%")
+
+    st.subheader("Results")
+
+    if matches_count == 0:
+        st.success("### 🎉 Excellent! No potential plagiarism matches were found.")
+    else:
+        tab1, tab2, tab3 = st.tabs(["📊 Highlights", "🔍 Detailed Findings", "📥 Download Report"])
+
+        with tab1:
+            st.info("Sentences flagged for potential plagiarism are highlighted below.")
+            highlighted_doc = generate_highlighted_text(analysis["document_text"], sentences, all_matches)
+            st.markdown(HIGHLIGHT_STYLE + f"<div style='border: 1px solid #ddd; padding: 15px; border-radius: 5px; background-color: #f9f9f9; max-height: 400px; overflow-y: auto;'>{highlighted_doc}</div>", unsafe_allow_html=True)
+
+        with tab2:
+            st.info("All findings are listed below; use the link column to open a source.")
+            st.dataframe(
+                findings_table(all_matches), hide_index=True, use_container_width=True,
+                column_config={"Link": st.column_config.LinkColumn("Link")}
+            )
+
+        with tab3:
+            st.info("Download a full text report of all findings for your records.")
+            summary_stats = {
+                "Total Sentences": total_sentences, "Total Words": total_words, "Matches Found": matches_count,
+                "Similarity": f"{similarity_percentage:.2f}%", "Originality": f"{originality_percentage:.2f}%"
+            }
+            report_data = generate_report_content(all_matches, summary_stats)
+            st.download_button(
+                label="📥 Download Full Report (.txt)", data=report_data, file_name="plagiarism_report.txt",
+                mime="text/plain", use_container_width=True
+            )
\ No newline at end of file